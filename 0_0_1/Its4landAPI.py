@@ -27,7 +27,13 @@ License:
 from typing import (Any, Optional, Dict, List)
 from enum import Enum
 from urllib.parse import (urljoin, quote)
+import base64
+import binascii
+import hashlib
 import os
+import re
+import threading
+import time
 
 import requests
 from requests import (request, exceptions)
@@ -71,6 +77,69 @@ class LogLevel(Enum):
 Payload = Dict[str, Any]
 
 
+class HashingReader:
+    """File wrapper computing a checksum of everything read through it."""
+
+    def __init__(self, fileobj, algorithm: str = 'md5'):
+        self.fileobj = fileobj
+        self.name = fileobj.name
+        self.digest = hashlib.new(algorithm)
+        self.size = 0
+        self.hash_seconds = 0.0
+
+    def update(self, chunk: bytes) -> None:
+        started = time.perf_counter()
+        self.digest.update(chunk)
+        self.hash_seconds += time.perf_counter() - started
+        self.size += len(chunk)
+
+    def read(self, *argv) -> bytes:
+        chunk = self.fileobj.read(*argv)
+        self.update(chunk)
+
+        return chunk
+
+    def close(self) -> None:
+        self.fileobj.close()
+
+
+def get_expected_checksum(headers) -> Optional[Dict[str, str]]:
+    """Checksum announced by the server in the response headers, if any."""
+    for digest in headers.get('Digest', '').split(','):
+        algorithm, _, value = digest.strip().partition('=')
+
+        if algorithm.lower() in ('sha-256', 'md5') and value:
+            return {
+                'algorithm': algorithm.lower().replace('-', ''),
+                'hexdigest': binascii.hexlify(base64.b64decode(value)).decode(),
+            }
+
+    if 'Content-MD5' in headers:
+        return {
+            'algorithm': 'md5',
+            'hexdigest': binascii.hexlify(base64.b64decode(headers['Content-MD5'])).decode(),
+        }
+
+    # single part uploads to most object stores use the md5 as ETag
+    etag = headers.get('ETag', '').strip('"')
+
+    if re.fullmatch('[0-9a-fA-F]{32}', etag):
+        return {
+            'algorithm': 'md5',
+            'hexdigest': etag.lower(),
+        }
+
+    return None
+
+
+def get_item_size(item: Any) -> Optional[int]:
+    """ContentSize of a content item, the only integrity information the platform returns."""
+    if not isinstance(item, dict) or item.get('ContentSize') is None:
+        return None
+
+    return int(item['ContentSize'])
+
+
 class Its4landException(Exception):
     """Custom exception."""
 
@@ -121,11 +190,31 @@ class Its4landAPI:
         self.response_type = response_type
         self.session_token = ''
 
+        self.transfer_stats = {
+            'files': 0,
+            'bytes': 0,
+            'seconds': 0.0,
+            'hash_seconds': 0.0,
+            'retries': 0,
+            'ranged_retries': 0,
+        }
+
+        # updated by the download threads as well
+        self._stats_lock = threading.Lock()
+
         adapter = requests.adapters.HTTPAdapter(max_retries=5)
 
         self.sess = requests.Session()
         self.sess.mount(url, adapter)
 
+    def warm_up(self, timeout: float = 10) -> None:
+        """Resolve the platform host and open a pooled connection to it.
+
+        Any response will do, the connection is kept alive in the session pool
+        for the requests that follow.
+        """
+        self.sess.head(self.url, headers={'X-Api-Key': self.api_key}, timeout=timeout).close()
+
     def get(self, *argv, **kwargs):
         return self.request('GET', *argv, **kwargs)
 
@@ -175,7 +264,7 @@ class Its4landAPI:
 
                 for k, v in files.items():
                     try:
-                        send_data['files'][k] = open(v, 'rb')
+                        send_data['files'][k] = v if hasattr(v, 'read') else open(v, 'rb')
                     except Exception as e:
                         raise Exception(url, 998, 'Unable to open file: %s' % v, e)
 
@@ -188,10 +277,11 @@ class Its4landAPI:
                 print(curlify.to_curl(resp.request))
 
             if resp is not None:
-                if resp.ok and resp.content is not None:
-                    if response_type == ResponseType.stream:
-                        return resp
-                    elif response_type == ResponseType.json:
+                # reading the content of a stream would buffer the whole body
+                if resp.ok and response_type == ResponseType.stream:
+                    return resp
+                elif resp.ok and resp.content is not None:
+                    if response_type == ResponseType.json:
                         return resp.json()
                     elif response_type == ResponseType.html:
                         return resp.content
@@ -253,14 +343,43 @@ class Its4landAPI:
             'uid': uid
         }, url=urljoin(self.url, 'contentitems'))
 
-    def upload_content_item(self, file: Any) -> Dict:
-        return self.post(
-            None,
-            url=urljoin(self.url, 'contentitems'),
-            files={
-                'newcontent': file,
-            }
-        )
+    def upload_content_item(self, file: Any, retries: int = 1) -> Dict:
+        """Upload a file, counting the bytes while it is read for sending.
+
+        The result is checked against the ContentSize of the returned content
+        item, the platform does not return a checksum.
+        """
+        url = urljoin(self.url, 'contentitems')
+
+        for attempt in range(retries + 1):
+            started = time.perf_counter()
+
+            with open(file, 'rb') as f:
+                reader = HashingReader(f, 'md5')
+                item = self.post(None, url=url, files={
+                    'newcontent': reader,
+                })
+
+            self._count_transfer(reader, time.perf_counter() - started)
+
+            error = None
+            item_size = get_item_size(item)
+
+            if item_size is not None and item_size != reader.size:
+                error = 'Platform stored {} bytes of {}'.format(item_size, reader.size)
+
+            if error is None:
+                return item
+
+            # the API offers no way to delete a content item, leave a trace of the rejected one
+            self.log(LogLevel.Warn, 'Upload of "{}" failed the integrity check: {}, content item {} is unusable'.format(
+                file, error, item.get('ContentID') if isinstance(item, dict) else item))
+
+            if attempt < retries:
+                self._count_retry()
+                self.log(LogLevel.Warn, 'Retrying upload of "{}" ...'.format(file))
+
+        raise Its4landException(url=url, msg='Upload of "{}" failed the integrity check'.format(file), content=error)
 
     def get_spatial_source(
         self,
@@ -337,28 +456,159 @@ class Its4landAPI:
             'Tags': tags,
         }, encode_as='json', url=urljoin(self.url, path))
 
-    def download_content_item(self, uid: str, filename: str):
+    def download_content_item(self, uid: str, filename: str, stop: Optional[threading.Event] = None):
         url = urljoin(self.url, 'contentitems/%s' % quote(uid, safe=''))
 
-        return self.download_file(None, url=url, filename=filename)
+        return self.download_file(None, url=url, filename=filename, stop=stop)
 
     def download_file(
                       self,
                       data: Optional[Payload],
                       filename: str,
+                      retries: int = 3,
+                      stop: Optional[threading.Event] = None,
                       **rest
     ) -> str:
-        resp = self.get(data, response_type=ResponseType.stream, **rest)
+        """Download a file, checksumming it while the bytes are written.
+
+        The result is checked against the announced size and hash. A
+        truncated transfer is resumed from the last good byte when the server
+        accepts ranged requests, otherwise the whole file is fetched again.
+        Setting `stop` cancels the download after the current chunk.
+        """
+        url = rest.get('url')
+        started = time.perf_counter()
+        expected_size = None
+        checksum = None
+        accept_ranges = False
+        error = None
+        headers = {}
 
         with open(filename, 'wb') as f:
-            for chunk in resp.iter_content(chunk_size=4096):
-                if not chunk:  # filter out keep-alive new chunks
-                    pass
+            reader = None
+
+            for attempt in range(retries + 1):
+                try:
+                    resp = self.get(data, response_type=ResponseType.stream, headers=headers, **rest)
+
+                    if reader is not None and resp.status_code == 206:
+                        content_range = re.match(r'bytes (\d+)-', resp.headers.get('Content-Range', ''))
+
+                        if content_range is None or int(content_range.group(1)) != reader.size:
+                            resp.close()
+                            raise exceptions.ContentDecodingError(
+                                'Unexpected range: {}'.format(resp.headers.get('Content-Range')))
+                    else:
+                        # either the first attempt or the server ignored the range
+                        f.seek(0)
+                        f.truncate()
+
+                        accept_ranges = resp.headers.get('Accept-Ranges') == 'bytes'
+                        checksum = None
+                        expected_size = None
+
+                        # length and checksum headers describe the encoded body, not the decoded bytes
+                        if not resp.headers.get('Content-Encoding'):
+                            checksum = get_expected_checksum(resp.headers)
+
+                            if 'Content-Length' in resp.headers:
+                                expected_size = int(resp.headers['Content-Length'])
+
+                        reader = HashingReader(f, checksum['algorithm'] if checksum else 'md5')
+
+                    # small chunks, urllib3 drops a partially filled one when the connection breaks
+                    for chunk in resp.iter_content(chunk_size=64 * 1024):
+                        if not chunk:  # filter out keep-alive new chunks
+                            continue
+
+                        if stop is not None and stop.is_set():
+                            resp.close()
+                            raise Its4landException(url=url, msg='Download of "{}" cancelled'.format(filename))
+
+                        f.write(chunk)
+                        reader.update(chunk)
+                except Its4landException as e:
+                    # HTTP errors are final, only broken connections are retried
+                    if e.code is not None or attempt == retries or (stop is not None and stop.is_set()):
+                        raise
+
+                    self.log(LogLevel.Warn, 'Transfer of "{}" interrupted: {}'.format(filename, e))
+                except exceptions.RequestException as e:
+                    # a dropped connection is handled like any truncated transfer
+                    self.log(LogLevel.Warn, 'Transfer of "{}" interrupted: {}'.format(filename, e))
+
+                if reader is None:
+                    error = 'No data received'
+                elif expected_size is not None and reader.size < expected_size:
+                    error = 'Received {} bytes of {}'.format(reader.size, expected_size)
+                elif expected_size is not None and reader.size > expected_size:
+                    error = 'Received {} bytes, expected {}'.format(reader.size, expected_size)
+                elif checksum is not None and reader.digest.hexdigest() != checksum['hexdigest']:
+                    error = 'Checksum mismatch, {} {} != {}'.format(
+                        checksum['algorithm'], reader.digest.hexdigest(), checksum['hexdigest'])
+                else:
+                    error = None
+                    break
+
+                if attempt == retries:
+                    break
+
+                if (
+                    accept_ranges and
+                    reader is not None and
+                    expected_size is not None and
+                    reader.size < expected_size
+                ):
+                    # only the missing tail has to be fetched again
+                    self._count_retry(ranged=True)
+                    headers = {'Range': 'bytes={}-'.format(reader.size)}
+                    self.log(LogLevel.Warn, '{}, resuming download of "{}" ...'.format(error, filename))
+                else:
+                    # the bad range cannot be located, start over
+                    self._count_retry()
+                    reader = None
+                    headers = {}
+                    self.log(LogLevel.Warn, '{}, downloading "{}" again ...'.format(error, filename))
 
-                f.write(chunk)
+        self._count_transfer(reader, time.perf_counter() - started)
+
+        if error is not None:
+            raise Its4landException(url=url, msg='Download of "{}" failed the integrity check'.format(filename),
+                                    content=error)
 
         return filename
 
+    def _count_transfer(self, reader: Optional[HashingReader], seconds: float) -> None:
+        with self._stats_lock:
+            self.transfer_stats['files'] += 1
+            self.transfer_stats['seconds'] += seconds
+
+            if reader is not None:
+                self.transfer_stats['bytes'] += reader.size
+                self.transfer_stats['hash_seconds'] += reader.hash_seconds
+
+    def _count_retry(self, ranged: bool = False) -> None:
+        with self._stats_lock:
+            self.transfer_stats['retries'] += 1
+
+            if ranged:
+                self.transfer_stats['ranged_retries'] += 1
+
+    def transfer_summary(self) -> str:
+        stats = self.transfer_stats
+        overhead = stats['hash_seconds'] / stats['seconds'] * 100 if stats['seconds'] else 0
+
+        return ('Transferred {} files ({:.1f} MiB) in {:.1f}s, integrity hashing took {:.2f}s '
+                '({:.1f}% overhead), {} retries ({} ranged)').format(
+                    stats['files'],
+                    stats['bytes'] / 1024 ** 2,
+                    stats['seconds'],
+                    stats['hash_seconds'],
+                    overhead,
+                    stats['retries'],
+                    stats['ranged_retries'],
+                )
+
     def log(self, level: LogLevel = LogLevel.Debug, *msgs, log_src: str = 'UAV Ortho Generator Tool'):
         pid = os.getenv('I4L_PROCESSUID')
 
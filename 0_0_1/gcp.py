@@ -0,0 +1,352 @@
+"""Ground control point list parsing and validation.
+
+A GCP list as understood by ODM starts with a CRS header (a proj4 string, an
+EPSG code or `WGS84 UTM <zone><N|S>`) followed by one row per observation:
+
+    geo_x geo_y geo_z im_x im_y image_name [gcp_name]
+
+The rows are parsed into NumPy arrays, reprojected to WGS84 in one batch and
+checked against the extracted images before any ODM time is spent.
+"""
+
+from typing import (Dict, List, Optional, Tuple)
+import os
+import re
+
+import numpy as np
+
+
+# Farthest a GCP may lie from the camera position of an image it is marked in.
+MAX_CAMERA_DISTANCE = 1000.0
+# Modified z-score of the camera distance above which a row is an outlier.
+MAX_OUTLIER_SCORE = 3.5
+# Distinct ground points ODM needs to georeference the model.
+MIN_GCPS = 3
+# Images a ground point should be marked in to be useful.
+MIN_IMAGES_PER_GCP = 3
+
+EARTH_RADIUS = 6371008.8
+
+
+class GCPError(Exception):
+    """The GCP list cannot be used, `report` lists the problems found."""
+
+    def __init__(self, msg: str, report: List[str] = None):
+        self.report = report or []
+
+        super().__init__('\n'.join([msg] + self.report))
+
+
+class GCPList:
+    """Parsed GCP list, one array element per observation."""
+
+    def __init__(self, header: str, lines: List[str], geo: np.ndarray, pixels: np.ndarray,
+                 images: np.ndarray, names: np.ndarray):
+        self.header = header
+        self.lines = lines
+        self.geo = geo
+        self.pixels = pixels
+        self.images = images
+        self.names = names
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def subset(self, mask: np.ndarray) -> 'GCPList':
+        return GCPList(
+            self.header,
+            [line for line, keep in zip(self.lines, mask) if keep],
+            self.geo[mask],
+            self.pixels[mask],
+            self.images[mask],
+            self.names[mask],
+        )
+
+    def rename_image(self, index: int, image: str) -> None:
+        """Change the image a row refers to, in the array and in the raw line."""
+        cols = self.lines[index].split()
+        cols[5] = image
+
+        self.lines[index] = ' '.join(cols)
+        self.images[index] = image
+
+    def point_ids(self) -> np.ndarray:
+        """Id of the ground point of each row, by name if given, otherwise by coordinates."""
+        keys = [
+            name if name else '{:.3f} {:.3f} {:.3f}'.format(*geo)
+            for name, geo in zip(self.names, self.geo)
+        ]
+
+        return np.unique(keys, return_inverse=True)[1]
+
+    def write(self, filename: str) -> str:
+        with open(filename, 'w', encoding='utf8') as f:
+            f.write(self.header + '\n')
+
+            for line in self.lines:
+                f.write(line + '\n')
+
+        return filename
+
+
+def parse_gcp_list(filename: str) -> Tuple[GCPList, List[str]]:
+    """Parse a GCP list, returns it together with the rows that were skipped."""
+    with open(filename, 'r', encoding='utf8', errors='replace') as f:
+        lines = [line.strip() for line in f]
+
+    lines = [line for line in lines if line and not line.startswith('#')]
+
+    if not lines:
+        raise GCPError('GCP list "{}" is empty'.format(filename))
+
+    header = lines[0]
+    rows = []
+    skipped = []
+
+    for number, line in enumerate(lines[1:], 2):
+        cols = line.split()
+
+        try:
+            assert len(cols) >= 6
+            rows.append((line, [float(c) for c in cols[:5]], cols[5], ' '.join(cols[6:])))
+        except (AssertionError, ValueError):
+            skipped.append('row {}: cannot parse "{}"'.format(number, line))
+
+    return GCPList(
+        header,
+        [row[0] for row in rows],
+        np.array([row[1][:3] for row in rows], dtype=np.float64).reshape(-1, 3),
+        np.array([row[1][3:] for row in rows], dtype=np.float64).reshape(-1, 2),
+        np.array([row[2] for row in rows], dtype=object),
+        np.array([row[3] for row in rows], dtype=object),
+    ), skipped
+
+
+def parse_crs(header: str):
+    """CRS of the GCP list header."""
+    from pyproj import CRS
+    from pyproj.exceptions import CRSError
+
+    match = re.fullmatch(r'WGS84 UTM (\d{1,2})\s*([NS])', header.strip(), re.IGNORECASE)
+
+    try:
+        if match:
+            zone = int(match.group(1))
+            return CRS.from_epsg((32600 if match.group(2).upper() == 'N' else 32700) + zone)
+
+        return CRS.from_user_input(header)
+    except CRSError as err:
+        raise GCPError('Unrecognized CRS header "{}": {}'.format(header, err))
+
+
+def to_wgs84(crs, x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Reproject all points at once, returns longitudes and latitudes."""
+    from pyproj import Transformer
+
+    transformer = Transformer.from_crs(crs, 'EPSG:4326', always_xy=True)
+    lon, lat = transformer.transform(x, y)
+
+    return np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64)
+
+
+def haversine(lon1: np.ndarray, lat1: np.ndarray, lon2: np.ndarray, lat2: np.ndarray) -> np.ndarray:
+    """Great circle distance in meters."""
+    lon1, lat1, lon2, lat2 = (np.radians(a) for a in (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def _to_float(value) -> float:
+    # older Pillow versions return rationals as (numerator, denominator)
+    if isinstance(value, tuple):
+        return float(value[0]) / float(value[1])
+
+    return float(value)
+
+
+def _to_degrees(value, ref: str) -> float:
+    degrees = sum(_to_float(v) / 60 ** i for i, v in enumerate(value))
+
+    return -degrees if ref in ('S', 'W') else degrees
+
+
+def read_image_info(filename: str) -> Dict:
+    """Image size and EXIF GPS position (if any) without decoding the pixels."""
+    from PIL import Image
+
+    with Image.open(filename) as img:
+        width, height = img.size
+        gps = {}
+
+        try:
+            gps = img.getexif().get_ifd(0x8825)
+        except AttributeError:
+            # Pillow < 8
+            gps = (img._getexif() or {}).get(0x8825, {})
+        except Exception:
+            pass
+
+    lon = lat = None
+
+    try:
+        lat = _to_degrees(gps[2], gps[1])
+        lon = _to_degrees(gps[4], gps[3])
+    except (KeyError, TypeError, ValueError, ZeroDivisionError):
+        pass
+
+    return {
+        'width': width,
+        'height': height,
+        'lon': lon,
+        'lat': lat,
+    }
+
+
+def robust_scores(values: np.ndarray) -> np.ndarray:
+    """Modified z-scores based on the median absolute deviation."""
+    if len(values) == 0:
+        return values
+
+    median = np.median(values)
+    mad = np.median(np.abs(values - median))
+
+    if mad == 0:
+        return np.zeros_like(values)
+
+    return 0.6745 * (values - median) / mad
+
+
+def validate_gcp_list(gcps: GCPList, image_dirname: str,
+                      max_distance: float = MAX_CAMERA_DISTANCE) -> Tuple[np.ndarray, List[str]]:
+    """Check every row against the images, returns the mask of usable rows and the report."""
+    report = []
+    keep = np.ones(len(gcps), dtype=bool)
+
+    if len(gcps) == 0:
+        return keep, report
+
+    crs = parse_crs(gcps.header)
+
+    filenames = os.listdir(image_dirname)
+    by_lower_name = {name.lower(): name for name in filenames}
+    renamed = {}  # type: Dict[str, str]
+
+    # ODM matches the image names exactly, fix up references differing only in case
+    for image in set(gcps.images) - set(filenames):
+        if image.lower() in by_lower_name:
+            renamed[image] = by_lower_name[image.lower()]
+
+    for i, image in enumerate(gcps.images):
+        if image in renamed:
+            report.append('"{}": image "{}" is named "{}" in the zip, renamed'.format(
+                gcps.lines[i], image, renamed[image]))
+            gcps.rename_image(i, renamed[image])
+
+    images = {}  # type: Dict[str, Optional[Dict]]
+    unreadable = set()
+
+    for image in set(gcps.images):
+        path = os.path.join(image_dirname, image)
+        images[image] = None
+
+        if os.path.isfile(path):
+            try:
+                images[image] = read_image_info(path)
+            except OSError:
+                # PIL.UnidentifiedImageError is an OSError as well
+                unreadable.add(image)
+
+    missing = np.array([images[image] is None for image in gcps.images])
+
+    for i in np.flatnonzero(missing):
+        if gcps.images[i] in unreadable:
+            report.append('"{}": image "{}" cannot be read'.format(gcps.lines[i], gcps.images[i]))
+        else:
+            report.append('"{}": image "{}" is not in the zip'.format(gcps.lines[i], gcps.images[i]))
+
+    keep &= ~missing
+
+    def image_values(key: str) -> np.ndarray:
+        return np.array([
+            np.nan if images[image] is None or images[image][key] is None else images[image][key]
+            for image in gcps.images
+        ], dtype=np.float64)
+
+    width, height = image_values('width'), image_values('height')
+    outside = ~missing & ~(
+        (gcps.pixels[:, 0] >= 0) & (gcps.pixels[:, 0] < width) &
+        (gcps.pixels[:, 1] >= 0) & (gcps.pixels[:, 1] < height)
+    )
+
+    for i in np.flatnonzero(outside):
+        report.append('"{}": pixel ({}, {}) is outside of the {}x{} image'.format(
+            gcps.lines[i], gcps.pixels[i, 0], gcps.pixels[i, 1], int(width[i]), int(height[i])))
+
+    keep &= ~outside
+
+    camera_lon, camera_lat = image_values('lon'), image_values('lat')
+    has_gps = ~np.isnan(camera_lon) & ~np.isnan(camera_lat)
+
+    if not has_gps.any():
+        report.append('No EXIF GPS positions found, the positions of the GCPs are not checked')
+        return keep, report
+
+    lon, lat = to_wgs84(crs, gcps.geo[:, 0], gcps.geo[:, 1])
+    distance = haversine(lon, lat, camera_lon, camera_lat)
+
+    candidates = keep & has_gps
+    too_far = candidates & ~(distance <= max_distance)
+
+    if too_far.sum() > candidates.sum() / 2:
+        swapped_lon, swapped_lat = to_wgs84(crs, gcps.geo[:, 1], gcps.geo[:, 0])
+        swapped = haversine(swapped_lon, swapped_lat, camera_lon, camera_lat)
+
+        if (swapped[candidates] <= max_distance).sum() > candidates.sum() / 2:
+            raise GCPError('The GCP axes look swapped, most points are close to their images only '
+                           'with X and Y exchanged. Check the axis order of the "{}" CRS'.format(gcps.header))
+
+        raise GCPError('Most GCPs are more than {} m away from the images they are marked in, '
+                       'check the "{}" CRS header. Median distance: {:.0f} m'.format(
+                           max_distance, gcps.header, np.nanmedian(distance[candidates])))
+
+    scores = np.zeros(len(gcps))
+    scores[candidates] = robust_scores(distance[candidates])
+    outliers = too_far | (candidates & (scores > MAX_OUTLIER_SCORE))
+
+    for i in np.flatnonzero(outliers):
+        report.append('"{}": {:.0f} m away from the camera position of "{}"'.format(
+            gcps.lines[i], distance[i], gcps.images[i]))
+
+    keep &= ~outliers
+
+    return keep, report
+
+
+def check_gcp_list(filename: str, image_dirname: str, max_distance: float = MAX_CAMERA_DISTANCE) -> List[str]:
+    """Validate a GCP list and rewrite it with the usable rows only.
+
+    Raises GCPError with the full report if not enough ground points remain.
+    """
+    gcps, skipped = parse_gcp_list(filename)
+    keep, report = validate_gcp_list(gcps, image_dirname, max_distance)
+    report = skipped + report
+
+    valid = gcps.subset(keep)
+    point_ids = valid.point_ids()
+    counts = np.bincount(point_ids) if len(valid) else np.array([], dtype=int)
+
+    for point_id in np.flatnonzero(counts < MIN_IMAGES_PER_GCP):
+        rows = np.flatnonzero(point_ids == point_id)
+        report.append('GCP "{}" is marked in {} image(s) only, at least {} are recommended'.format(
+            valid.names[rows[0]] or valid.lines[rows[0]], counts[point_id], MIN_IMAGES_PER_GCP))
+
+    report.append('{} of {} GCP rows usable, {} distinct GCPs'.format(
+        len(valid), len(gcps) + len(skipped), len(counts)))
+
+    if len(counts) < MIN_GCPS:
+        raise GCPError('At least {} usable GCPs are needed, found {}'.format(MIN_GCPS, len(counts)), report)
+
+    valid.write(filename)
+
+    return report
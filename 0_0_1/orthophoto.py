@@ -8,39 +8,69 @@ import zipfile
 import traceback
 import subprocess
 import time
-import tempfile
 import json
 import pathlib
-
-import imageio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 try:
+    from . import startup
     from .Its4landAPI import Its4landAPI, Its4landException, LogLevel
+    from .workspace import Workspace, ODM_INTERMEDIATES
+    from .pointcloud import build_copc, find_tiler
 except:
+    import startup
     from Its4landAPI import Its4landAPI, Its4landException, LogLevel
+    from workspace import Workspace, ODM_INTERMEDIATES
+    from pointcloud import build_copc, find_tiler
 
 
 # sample call:
 # python3 orthophoto.py --texturing-nadir-weight urban --spatial-source-id 487c67f5-7820-4d1b-bc0b-274c59157053 --project-id 8d7e9cf1-1a4d-4366-992d-7ae49370978a
 
 PROJECT_PATH = '/datasets'
-WORK_VOLUME = os.path.join(PROJECT_PATH, 'code')
-# WORK_VOLUME = './0_0_1/dataset'
+# ODM keeps its files in a folder named after the project inside the project path
+PROJECT_NAME = 'code'
 PLATFORM_URL = 'https://platform.its4land.com/api/'
 PLATFORM_API_KEY = '1'
+# Free space below which a warning is logged before the download starts.
+MIN_FREE_SPACE = 10 * 1024 ** 3
 
 if 'I4L_PUBLICAPIURL' in os.environ:
     PLATFORM_URL = os.environ['I4L_PUBLICAPIURL']
 
+if 'I4L_PROJECTPATH' in os.environ:
+    PROJECT_PATH = os.environ['I4L_PROJECTPATH']
+
 
 def unzip(file: str, dest: str) -> None:
     """Unzip specified file to a destination."""
     with zipfile.ZipFile(file, 'r') as zip_ref:
+        extracted_size = sum(info.file_size for info in zip_ref.infolist())
+        free_space = shutil.disk_usage(os.path.dirname(os.path.abspath(dest))).free
+
+        assert extracted_size < free_space, 'Not enough disk space to extract "{}": {} bytes needed, {} free'.format(
+            file, extracted_size, free_space)
+
         zip_ref.extractall(dest)
 
 
+def copy_file(src: str, dest: str, stop: threading.Event) -> str:
+    """Copy a file in chunks, stops early once `stop` is set."""
+    with open(src, 'rb') as fsrc, open(dest, 'wb') as fdest:
+        for chunk in iter(lambda: fsrc.read(1024 * 1024), b''):
+            if stop.is_set():
+                raise Exception('Copy of "{}" cancelled'.format(src))
+
+            fdest.write(chunk)
+
+    return dest
+
+
 def get_image_properties(dirname: str) -> Dict:
     """Get image properties like size etc."""
+    import imageio
+
     image_basename = None
 
     for file in os.listdir(dirname):
@@ -88,7 +118,7 @@ def to_odm_args(args: Dict[str, str], image_max_side_size: int) -> Dict[str, Any
     defaults['dem_resolution'] = defaults['dem_resolution']
     defaults['orthophoto_resolution'] = defaults['orthophoto_resolution']
     defaults['min_num_features'] = defaults['min_num_features']
-    defaults['project_path'] = PROJECT_PATH
+    defaults['project_path'] = defaults['project_path']
 
     if defaults['georeferencing'] == 'EXIF':
         defaults['use_exif'] = True
@@ -99,6 +129,12 @@ def to_odm_args(args: Dict[str, str], image_max_side_size: int) -> Dict[str, Any
     del defaults['spatial_source_id']
     del defaults['project_id']
     del defaults['zip']
+    # let ODM drop its heavy intermediates while it runs, they would be deleted afterwards anyway
+    defaults['optimize_disk_space'] = defaults['intermediates'] == 'delete'
+
+    del defaults['intermediates']
+    del defaults['pc_tiles']
+    del defaults['pc_tiles_only']
 
     return defaults
 
@@ -129,18 +165,56 @@ def stringify_args(args: Dict[str, Any]) -> List[str]:
     return arr
 
 
+def finish_stage(api: Its4landAPI, workspace: Workspace, stage: str) -> None:
+    """Finish a workspace stage and log the released artifacts."""
+    for path, action, warning in workspace.finish_stage(stage):
+        if warning is not None:
+            api.log(LogLevel.Warn, 'Workspace: {} "{}": {}'.format(action, path, warning))
+        else:
+            api.log(LogLevel.Info, 'Workspace: {} "{}"'.format(action, path))
+
+
+def upload_point_cloud(api: Its4landAPI, spatial_source_id: str, point_cloud_filename: str) -> None:
+    """Upload the raw LAZ point cloud as additional document."""
+    api.log(LogLevel.Info, 'Uploading LAZ point cloud...')
+
+    point_cloud = api.upload_content_item(point_cloud_filename)
+    point_cloud_id = point_cloud['ContentID']
+
+    api.post_additional_document(
+        spatial_source_id, point_cloud_id, type='PointCloud', descr='Point Cloud in LAZ format')
+
+
 def start(args: Dict) -> None:
     """Run orthophoto creation."""
+    workspace = None
+    warm_up = None
+    stop = threading.Event()
+    work_volume = os.path.join(args['project_path'], PROJECT_NAME)
+
+    # created before anything can fail, the error handlers log through it
+    api = Its4landAPI(url=PLATFORM_URL, api_key=PLATFORM_API_KEY)
+    api.session_token = '1'
+
     try:
-        pathlib.Path(WORK_VOLUME).mkdir(parents=True, exist_ok=True)
+        pathlib.Path(work_volume).mkdir(parents=True, exist_ok=True)
+
+        cold_start = startup.process_uptime()
+
+        # warm-up runs while the first downloads are already in flight
+        warm_up = ThreadPoolExecutor(max_workers=3, thread_name_prefix='warm-up')
+        connection = warm_up.submit(api.warm_up)
+        disk_usage = warm_up.submit(shutil.disk_usage, work_volume)
 
-        api = Its4landAPI(url=PLATFORM_URL, api_key=PLATFORM_API_KEY)
-        api.session_token = '1'
+        workspace = Workspace(work_volume)
+        workspace.start_monitor()
 
         project_id = os.environ['I4L_PROJECTUID'] if 'I4L_PROJECTUID' in os.environ else args['project_id']
 
         assert project_id is not None, 'Missing project id'
 
+        api.log(LogLevel.Info, 'Cold start: {:.2f}s from process start to the first request'.format(cold_start))
+
         api.log(LogLevel.Info, 'Downloading ...'.format())
 
         spatial_source = api.get_spatial_source(args['spatial_source_id'])
@@ -150,18 +224,37 @@ def start(args: Dict) -> None:
 
         assert spatial_source['Type'] == 'UAVimagery', 'Expected the spatial source type to be "UAVimagery"'
 
+        downloaded_filename = workspace.register('images.zip', needed_until='extract')
+        extracted_dirname = workspace.register('images', needed_until='odm')
+
+        for dirname in ODM_INTERMEDIATES:
+            workspace.register(dirname, needed_until='odm', on_release=args['intermediates'])
+
+        # the zip is by far the largest download, fetch it alongside the additional documents
+        if args['zip']:
+            api.log(LogLevel.Info, 'Using local zip!')
+            zip_download = warm_up.submit(copy_file, args['zip'], downloaded_filename, stop)
+        else:
+            api.log(LogLevel.Info, 'Downloading zip ...')
+            zip_download = warm_up.submit(
+                api.download_content_item, spatial_source['ContentItem'], downloaded_filename, stop)
+
+        if disk_usage.result().free < MIN_FREE_SPACE:
+            api.log(LogLevel.Warn, 'Only {} bytes free in "{}"'.format(disk_usage.result().free, work_volume))
+
         for doc in api.get_additional_documents(args['spatial_source_id']):
             if doc['Type'] == 'Metadata':
                 assert metadata_id is None, 'Metadata has already been defined, aborting...'
-                tmp = tempfile.NamedTemporaryFile(mode='w+', encoding='utf8')
-                api.download_content_item(doc['ContentItem'], tmp.name)
+                metadata_filename = workspace.hot_path('metadata.json', needed_until='download')
+                api.download_content_item(doc['ContentItem'], metadata_filename)
 
                 metadata_id = doc['ContentItem']
 
-                metadata = json.load(tmp)
+                with open(metadata_filename, 'r', encoding='utf8') as f:
+                    metadata = json.load(f)
             elif doc['Type'] == 'GCP List':
-                assert metadata_id is None, 'GCP list have already been defined, aborting...'
-                gcp_filename = os.path.join(WORK_VOLUME, 'gcp_list.txt')
+                assert gcp_filename is None, 'GCP list have already been defined, aborting...'
+                gcp_filename = workspace.hot_path('gcp_list.txt', needed_until='odm')
                 api.download_content_item(doc['ContentItem'], gcp_filename)
 
             print(doc)
@@ -174,21 +267,33 @@ def start(args: Dict) -> None:
 
             assert gcp_filename is not None, 'GCP file is missing'
 
-        downloaded_filename = os.path.join(WORK_VOLUME, 'images.zip')
-        extracted_dirname = os.path.join(WORK_VOLUME, 'images')
+        zip_download.result()
+        warm_up.shutdown()
 
-        if args['zip']:
-            api.log(LogLevel.Info, 'Using local zip!')
-            shutil.copyfile(args['zip'], downloaded_filename)
-        else:
-            api.log(LogLevel.Info, 'Downloading zip ...')
-            api.download_content_item(spatial_source['ContentItem'], downloaded_filename)
+        if connection.exception() is not None:
+            api.log(LogLevel.Warn, 'Warm-up connection failed:', connection.exception())
+
+        finish_stage(api, workspace, 'download')
 
         unzip(downloaded_filename, extracted_dirname)
 
+        finish_stage(api, workspace, 'extract')
+
         api.log(LogLevel.Info, 'Extracted dir contents:',
                 os.listdir(extracted_dirname))
 
+        if args['georeferencing'] == 'GCP':
+            try:
+                from .gcp import check_gcp_list
+            except:
+                from gcp import check_gcp_list
+
+            api.log(LogLevel.Info, 'Checking GCP list ...')
+
+            report = check_gcp_list(gcp_filename, extracted_dirname)
+
+            api.log(LogLevel.Info, 'GCP list report:\n' + '\n'.join(report))
+
         image_props = get_image_properties(extracted_dirname)
         image_max_side_size = max(image_props['width'], image_props['height'])
 
@@ -207,7 +312,15 @@ def start(args: Dict) -> None:
             api.log(LogLevel.Error, msg)
             raise Exception(msg)
 
-        orthophoto_filename = os.path.join(WORK_VOLUME, 'odm_orthophoto', 'odm_orthophoto.tif')
+        orthophoto_filename = workspace.register(
+            os.path.join('odm_orthophoto', 'odm_orthophoto.tif'), needed_until='upload')
+        dsm_filename = workspace.register(
+            os.path.join('odm_dem', 'dsm.tif'), needed_until='upload')
+        point_cloud_filename = workspace.register(
+            os.path.join('odm_georeferencing', 'odm_georeferenced_model.laz'), needed_until='upload')
+
+        finish_stage(api, workspace, 'odm')
+
         name = get_orthophoto_name(spatial_source['Name'], metadata)
         api.log(LogLevel.Info, 'Uploading orthophoto "{}" ...'.format(name))
 
@@ -245,9 +358,6 @@ def start(args: Dict) -> None:
         )
 
         if args['dsm']:
-            dsm_filename = os.path.join(
-                WORK_VOLUME, 'odm_dem', 'dsm.tif')
-
             api.log(LogLevel.Info, 'Uploading DSM...')
 
             dsm_content_item = api.upload_content_item(dsm_filename)
@@ -256,22 +366,37 @@ def start(args: Dict) -> None:
             api.post_additional_document(
                 spatial_source_id, dsm_content_item_id, type='DSM', descr='DSM')
 
-        if args['pc_las']:
-            point_cloud_filename = os.path.join(
-                WORK_VOLUME, 'odm_georeferencing', 'odm_georeferenced_model.laz')
+        if args['pc_las'] and not args['pc_tiles_only']:
+            upload_point_cloud(api, spatial_source_id, point_cloud_filename)
 
-            api.log(LogLevel.Info, 'Uploading LAZ point cloud...')
+        if args['pc_tiles']:
+            # runs after the primary uploads, a failed tiling must not lose the ODM results
+            try:
+                api.log(LogLevel.Info, 'Building COPC point cloud ...')
 
-            point_cloud = api.upload_content_item(point_cloud_filename)
-            point_cloud_id = point_cloud['ContentID']
+                copc_filename = workspace.register(
+                    build_copc(point_cloud_filename, workspace.path('odm_georeferenced_model.copc.laz')),
+                    needed_until='upload')
 
-            api.post_additional_document(
-                spatial_source_id, point_cloud_id, type='PointCloud', descr='Point Cloud in LAZ format')
+                api.log(LogLevel.Info, 'Uploading COPC point cloud...')
+
+                copc = api.upload_content_item(copc_filename)
+                copc_id = copc['ContentID']
+
+                api.post_additional_document(
+                    spatial_source_id, copc_id, type='PointCloud', descr='Point Cloud in COPC format')
+            except Exception as err:
+                api.log(LogLevel.Warn, 'Building the COPC point cloud failed:', err)
+
+                if args['pc_tiles_only']:
+                    upload_point_cloud(api, spatial_source_id, point_cloud_filename)
+
+        finish_stage(api, workspace, 'upload')
 
         api.log(LogLevel.Info, 'Successfully uploaded everything! Finished!')
 
     except Its4landException as err:
-        api.log(LogLevel.Error, 'ERROR: ', err.error, err.content)
+        api.log(LogLevel.Error, 'ERROR: ', err.msg, err.error, err.content)
 
         traceback.print_exc()
         exit(2)
@@ -280,6 +405,19 @@ def start(args: Dict) -> None:
         api.log(LogLevel.Error, 'ERROR: ', err)
         traceback.print_exc()
         exit(1)
+    finally:
+        if warm_up is not None:
+            # a failed run must not wait for the zip download, nor let it write after the cleanup
+            stop.set()
+            warm_up.shutdown(wait=True)
+
+        if workspace is not None:
+            workspace.close()
+
+        if workspace is not None:
+            api.log(LogLevel.Info, workspace.summary())
+
+        api.log(LogLevel.Info, api.transfer_summary())
 
 
 def parse_args():
@@ -321,6 +459,15 @@ def parse_args():
     parser.add_argument('--pc-las', action='store_true',
                         help='Export the georeferenced point cloud in LAS '
                              'format. Default: False')
+    parser.add_argument('--pc-tiles', action='store_true',
+                        help='Also build a Cloud Optimized Point Cloud '
+                             '(COPC), a LAZ file ordered as an octree, from '
+                             'the LAS point cloud. Requires --pc-las and '
+                             'untwine. Default: False')
+    parser.add_argument('--pc-tiles-only', action='store_true',
+                        help='Upload only the COPC point cloud instead of '
+                             'the raw LAZ file. Requires --pc-tiles. '
+                             'Default: False')
     parser.add_argument('--dsm', action='store_true',
                         help='Use this tag to build a DSM (Digital Surface '
                              'Model, ground + objects) using a progressive '
@@ -342,9 +489,31 @@ def parse_args():
                         help='zipfile storing the data')
     parser.add_argument('--project-id', type=str,
                         help='Project id.')
+    parser.add_argument('--project-path', type=str, default=PROJECT_PATH,
+                        help='Path to the project folder, ODM works in its '
+                             '"{}" subfolder. Default: {}'.format(PROJECT_NAME, PROJECT_PATH))
+    parser.add_argument('--max-concurrency', type=int, metavar='<positive integer>',
+                        help='The maximum number of processes ODM uses. '
+                             'Default: all cores')
+    parser.add_argument('--intermediates', type=str, default='delete',
+                        choices=('delete', 'compress', 'keep'),
+                        help='What to do with ODM intermediates (OpenSfM, '
+                             'depthmaps, meshes) once ODM has finished, with '
+                             '"delete" ODM already drops the heavy ones while '
+                             'it runs. Default: delete')
 
     args = parser.parse_args()
 
+    if args.pc_tiles and not args.pc_las:
+        parser.error('--pc-tiles requires --pc-las')
+
+    if args.pc_tiles_only and not args.pc_tiles:
+        parser.error('--pc-tiles-only requires --pc-tiles')
+
+    # fail before ODM runs for hours rather than when tiling
+    if args.pc_tiles and find_tiler('untwine') is None:
+        parser.error('--pc-tiles requires untwine, which is not installed')
+
     return vars(args)
 
 
@@ -0,0 +1,51 @@
+"""Level-of-detail tiling of the georeferenced point cloud.
+
+The LAZ produced by ODM is one flat file, so viewers have to fetch all of it
+before rendering. Untwine rewrites it as a Cloud Optimized Point Cloud: a
+single LAZ 1.4 file whose chunks are ordered as an octree, so a client can
+read the coarse levels first with ranged requests. Untwine buckets the input
+on disk in chunks, keeps the memory use bounded and writes the octree nodes
+from several threads.
+"""
+
+from typing import Optional
+import os
+import shutil
+import subprocess
+
+
+# ODM builds its tools in the SuperBuild and does not put them on PATH.
+ODM_BIN_DIR = '/code/SuperBuild/install/bin'
+
+
+def find_tiler(name: str = 'untwine') -> Optional[str]:
+    """Full path of the tiler executable, None if it is not installed."""
+    return shutil.which(name) or shutil.which(name, path=ODM_BIN_DIR)
+
+
+def build_copc(laz_filename: str, dest_filename: str) -> str:
+    """Build a Cloud Optimized Point Cloud from a LAZ file."""
+    assert os.path.isfile(laz_filename), 'Point cloud "%s" does not exist' % laz_filename
+
+    untwine = find_tiler('untwine')
+
+    if untwine is None:
+        raise Exception('Point cloud tiler "untwine" is not available')
+
+    temp_dirname = dest_filename + '_tmp'
+
+    try:
+        returncode = subprocess.call([
+            untwine,
+            '--files={}'.format(laz_filename),
+            '--output_dir={}'.format(dest_filename),
+            '--temp_dir={}'.format(temp_dirname),
+            '--single_file',
+        ])
+    finally:
+        shutil.rmtree(temp_dirname, ignore_errors=True)
+
+    if returncode != 0:
+        raise Exception('ERROR: Called untwine and received return code: {}'.format(returncode))
+
+    return dest_filename
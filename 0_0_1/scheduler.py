@@ -0,0 +1,187 @@
+"""Run several orthophoto jobs side by side on one node.
+
+ODM scales poorly on small flights, so a big node is better used by running
+a few of them at once. Every job gets its own project path and log file and
+an equal share of the cores through `--max-concurrency`. The available memory
+limits how many jobs run at the same time.
+
+The jobs file is a JSON list, every entry holds the command line arguments of
+`orthophoto.py` and optionally a name, extra environment variables and its own
+`max_concurrency`. The scheduler's own `I4L_PROCESSUID` and `I4L_PROJECTUID`
+are not passed on, so each job logs to the platform process given in its env:
+
+    [
+        {"name": "flight-1", "args": ["--texturing-nadir-weight", "urban", "--spatial-source-id", "..."]},
+        {"name": "flight-2", "args": [...], "env": {"I4L_PROCESSUID": "..."}, "max_concurrency": 4}
+    ]
+
+sample call:
+python3 scheduler.py jobs.json --jobs-path /datasets/jobs
+"""
+
+from typing import (Dict, List, Any)
+import os
+import sys
+import json
+import time
+import argparse
+import pathlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from .workspace import available_memory
+except:
+    from workspace import available_memory
+
+
+ORTHOPHOTO_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'orthophoto.py')
+JOBS_PATH = '/datasets/jobs'
+# Smallest share of the node a job is started with.
+MIN_CORES_PER_JOB = 2
+MIN_MEMORY_PER_JOB = 8 * 1024 ** 3
+# Per process settings of the platform, a job only gets them from its own "env".
+JOB_ENV_VARS = ('I4L_PROCESSUID', 'I4L_PROJECTUID')
+
+
+def load_jobs(filename: str) -> List[Dict[str, Any]]:
+    """Load the jobs file and fill in the defaults."""
+    with open(filename, 'r', encoding='utf8') as f:
+        jobs = json.load(f)
+
+    assert isinstance(jobs, list), 'Expected a list of jobs in "{}"'.format(filename)
+
+    names = set()
+
+    for idx, job in enumerate(jobs):
+        if isinstance(job, list):
+            job = jobs[idx] = {'args': job}
+
+        assert isinstance(job.get('args'), list), 'Job #{} has no argument list'.format(idx)
+        assert all(isinstance(arg, str) for arg in job['args']), \
+            'Job #{}: all arguments have to be strings'.format(idx)
+
+        job.setdefault('name', 'job-{}'.format(idx))
+        job.setdefault('env', {})
+        job.setdefault('max_concurrency', None)
+
+        # the name is the folder of the job below the jobs path
+        name = job['name']
+        assert isinstance(name, str) and name not in ('', '.', '..') and os.path.basename(name) == name, \
+            'Job #{}: "{}" is not a valid job name'.format(idx, name)
+        assert isinstance(job['env'], dict) and all(
+            isinstance(k, str) and isinstance(v, str) for k, v in job['env'].items()), \
+            'Job #{}: env has to map strings to strings'.format(idx)
+
+        assert job['name'] not in names, 'Job name "{}" is used twice'.format(job['name'])
+        names.add(job['name'])
+
+    return jobs
+
+
+def get_slots(job_count: int, cores: int, memory: int, max_parallel: int = None) -> int:
+    """Number of jobs that can run at the same time."""
+    slots = min(job_count, max(cores // MIN_CORES_PER_JOB, 1))
+
+    if memory:
+        slots = min(slots, max(memory // MIN_MEMORY_PER_JOB, 1))
+
+    if max_parallel:
+        slots = min(slots, max_parallel)
+
+    return max(slots, 1)
+
+
+def job_command(job: Dict[str, Any], project_path: str, max_concurrency: int) -> List[str]:
+    return [
+        sys.executable, '-u', ORTHOPHOTO_SCRIPT,
+        *job['args'],
+        '--project-path', project_path,
+        '--max-concurrency', str(job['max_concurrency'] or max_concurrency),
+    ]
+
+
+def run_job(job: Dict[str, Any], jobs_path: str, max_concurrency: int) -> Dict[str, Any]:
+    """Run one job in its own process, its output goes to `<project path>/job.log`."""
+    project_path = os.path.join(jobs_path, job['name'])
+    pathlib.Path(project_path).mkdir(parents=True, exist_ok=True)
+
+    log_filename = os.path.join(project_path, 'job.log')
+    env = {k: v for k, v in os.environ.items() if k not in JOB_ENV_VARS}
+    env.update(job['env'])
+    started = time.time()
+
+    with open(log_filename, 'ab') as log:
+        returncode = subprocess.call(
+            job_command(job, project_path, max_concurrency),
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            env=env,
+        )
+
+    return {
+        'name': job['name'],
+        'returncode': returncode,
+        'seconds': time.time() - started,
+        'log': log_filename,
+    }
+
+
+def schedule(jobs: List[Dict[str, Any]], jobs_path: str, max_parallel: int = None) -> List[Dict[str, Any]]:
+    """Run all jobs, splitting the cores and the memory between the running ones."""
+    cores = os.cpu_count() or 1
+    memory = available_memory()
+    slots = get_slots(len(jobs), cores, memory, max_parallel)
+    max_concurrency = max(cores // slots, 1)
+
+    print('Running {} jobs, {} at a time with {} cores each'.format(len(jobs), slots, max_concurrency))
+
+    with ThreadPoolExecutor(max_workers=slots) as executor:
+        futures = [executor.submit(run_job, job, jobs_path, max_concurrency) for job in jobs]
+        results = []
+
+        for job, future in zip(jobs, futures):
+            try:
+                result = future.result()
+            except Exception as err:
+                result = {
+                    'name': job['name'],
+                    'returncode': None,
+                    'seconds': 0,
+                    'log': 'failed to start: {}'.format(err),
+                }
+
+            results.append(result)
+
+            print('[{}] finished with return code {} in {:.0f}s, log: {}'.format(
+                result['name'], result['returncode'], result['seconds'], result['log']))
+
+    return results
+
+
+def parse_args():
+    """Parse command line argument."""
+    parser = argparse.ArgumentParser(
+        description='Run several orthophoto jobs in parallel on one node',
+        epilog='This tool is part of the Publish and Share platform'
+    )
+
+    parser.add_argument('jobs', type=str,
+                        help='JSON file with the list of jobs.')
+    parser.add_argument('--jobs-path', type=str, default=JOBS_PATH,
+                        help='Folder where every job gets its own project '
+                             'path. Default: {}'.format(JOBS_PATH))
+    parser.add_argument('--max-parallel', type=int,
+                        help='Maximum number of jobs running at the same '
+                             'time. Default: as many as cores and memory allow')
+
+    args = parser.parse_args()
+
+    return vars(args)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    results = schedule(load_jobs(args['jobs']), args['jobs_path'], args['max_parallel'])
+
+    exit(0 if all(r['returncode'] == 0 for r in results) else 1)
@@ -0,0 +1,25 @@
+"""Cold start measurements.
+
+The import time of every module is reported by Python itself: with
+`I4L_PROFILE_STARTUP=1` the container entrypoint runs the interpreter with
+`-X importtime`, which writes it to stderr from the very first import on.
+"""
+
+import os
+
+
+def process_uptime() -> float:
+    """Seconds since the current process has been started, 0 if unknown."""
+    try:
+        with open('/proc/self/stat', 'r') as f:
+            # the command name may contain spaces, the fields follow the last parenthesis
+            fields = f.read().rsplit(')', 1)[1].split()
+
+        with open('/proc/uptime', 'r') as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return 0.0
+
+    started = int(fields[19]) / os.sysconf('SC_CLK_TCK')
+
+    return max(uptime - started, 0.0)
@@ -0,0 +1,302 @@
+"""Disk footprint management for the ODM work volume.
+
+The work volume holds the downloaded zip, the extracted images and every ODM
+intermediate. Most of these are dead weight once the stage that consumes them
+is over, so each artifact is registered together with the last stage that
+needs it and is released (deleted or compressed) as soon as that stage is
+finished. Small, hot files can be placed on tmpfs when enough memory is
+available.
+
+ODM itself is a single stage here: its intermediates are released only after
+ODM has exited, which lowers the footprint of the upload but not the peak
+reached while ODM is running. Splitting ODM into `--end-with`/`--rerun-from`
+runs does not help, every run checks the stages before it again and redoes
+the ones whose outputs are gone. Within the run, `--optimize-disk-space` lets
+ODM delete its own heavy intermediates (depthmaps, undistorted images) right
+after their last consumer, the orthophoto job passes it with the default
+`delete` policy.
+"""
+
+from typing import (Dict, List, Optional, Tuple)
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+
+
+# Pipeline stages in execution order. An artifact registered as needed until
+# a stage is released once that stage (or any later one) is finished.
+STAGES = ('download', 'extract', 'odm', 'upload')
+
+# Release policies for artifacts that are no longer needed.
+DELETE = 'delete'
+COMPRESS = 'compress'
+KEEP = 'keep'
+
+# Directories ODM leaves behind in the project folder that are not consumed
+# by the upload step.
+ODM_INTERMEDIATES = (
+    'opensfm',
+    'mve',
+    'smvs',
+    'odm_filterpoints',
+    'odm_meshing',
+    'odm_texturing',
+    'odm_25dmeshing',
+    'odm_25dtexturing',
+)
+
+TMPFS_DIR = '/dev/shm'
+# Memory that must stay available after placing a file on tmpfs.
+TMPFS_RESERVE = 2 * 1024 ** 3
+# Space that must stay free on tmpfs after placing a file there.
+TMPFS_MIN_FREE = 16 * 1024 ** 2
+
+
+def format_size(size: int) -> str:
+    """Human readable byte size."""
+    value = float(size)
+
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if value < 1024:
+            return '{:.1f} {}'.format(value, unit)
+        value /= 1024
+
+    return '{:.1f} TiB'.format(value)
+
+
+def disk_usage(path: str) -> int:
+    """Bytes allocated on disk by a file or a directory tree."""
+    if not os.path.lexists(path):
+        return 0
+
+    if not os.path.isdir(path) or os.path.islink(path):
+        return os.lstat(path).st_blocks * 512
+
+    total = 0
+
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in dirnames + filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_blocks * 512
+            except OSError:
+                # files may vanish while ODM is running
+                pass
+
+    return total
+
+
+def available_memory() -> int:
+    """Available memory in bytes as reported by the kernel, 0 if unknown."""
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+
+    return 0
+
+
+class Artifact:
+    """A file or directory in the workspace with a limited lifetime."""
+
+    def __init__(self, path: str, needed_until: str, on_release: str = DELETE):
+        assert needed_until in STAGES, 'Unknown stage: %s' % needed_until
+        assert on_release in (DELETE, COMPRESS, KEEP), 'Unknown release policy: %s' % on_release
+
+        self.path = path
+        self.needed_until = needed_until
+        self.on_release = on_release
+
+
+class Workspace:
+    """Tracks the artifacts in the work volume and the peak disk footprint."""
+
+    def __init__(self, root: str, sample_interval: float = 15.0):
+        self.root = root
+        self.sample_interval = sample_interval
+        self.artifacts = []  # type: List[Artifact]
+        self.finished = []  # type: List[str]
+        self.peak_bytes = 0
+        self.peak_stage = None  # type: Optional[str]
+        self.current_stage = STAGES[0]
+        self.released = {}  # type: Dict[str, int]
+        self.hot_dir = None  # type: Optional[str]
+        self.hot_files = []  # type: List[str]
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._monitor = None  # type: Optional[threading.Thread]
+
+    def path(self, *parts: str) -> str:
+        return os.path.join(self.root, *parts)
+
+    def register(self, path: str, needed_until: str, on_release: str = DELETE) -> str:
+        """Register an artifact, relative paths are resolved against the root."""
+        if not os.path.isabs(path):
+            path = self.path(path)
+
+        self.artifacts.append(Artifact(path, needed_until, on_release))
+
+        return path
+
+    def hot_path(self, name: str, size_hint: int = 0, needed_until: str = 'upload') -> str:
+        """Path for a small, frequently accessed file.
+
+        The file is placed on tmpfs if it is mounted and both the memory and
+        the tmpfs space left after storing it are above the reserves,
+        otherwise it lives in the work volume.
+        """
+        if (
+            os.path.isdir(TMPFS_DIR) and
+            os.access(TMPFS_DIR, os.W_OK) and
+            available_memory() - size_hint > TMPFS_RESERVE and
+            # Docker limits /dev/shm to 64 MiB unless told otherwise
+            shutil.disk_usage(TMPFS_DIR).free - size_hint > TMPFS_MIN_FREE
+        ):
+            if self.hot_dir is None:
+                self.hot_dir = tempfile.mkdtemp(prefix='i4l-', dir=TMPFS_DIR)
+
+            path = os.path.join(self.hot_dir, name)
+            self.hot_files.append(path)
+        else:
+            path = self.path(name)
+
+        return self.register(path, needed_until)
+
+    def sample(self) -> int:
+        """Measure the current footprint and update the peak."""
+        size = disk_usage(self.root)
+
+        for path in list(self.hot_files):
+            size += disk_usage(path)
+
+        with self._lock:
+            if size > self.peak_bytes:
+                self.peak_bytes = size
+                self.peak_stage = self.current_stage
+
+        return size
+
+    def start_monitor(self) -> None:
+        """Sample the footprint periodically in a background thread."""
+        if self._monitor is not None:
+            return
+
+        def run():
+            while not self._stop.wait(self.sample_interval):
+                self.sample()
+
+        self._stop.clear()
+        self._monitor = threading.Thread(target=run, name='workspace-monitor', daemon=True)
+        self._monitor.start()
+
+    def stop_monitor(self) -> None:
+        if self._monitor is None:
+            return
+
+        self._stop.set()
+        self._monitor.join()
+        self._monitor = None
+
+    def finish_stage(self, stage: str) -> List[Tuple[str, str, Optional[str]]]:
+        """Mark a stage as finished and release the artifacts nobody needs anymore.
+
+        Returns the list of (path, action, warning) tuples that were released,
+        the warning is None unless the release policy could not be followed.
+        """
+        assert stage in STAGES, 'Unknown stage: %s' % stage
+
+        # the footprint is the largest right before the cleanup
+        self.sample()
+
+        index = STAGES.index(stage)
+        released = []
+        remaining = []
+
+        for artifact in self.artifacts:
+            if STAGES.index(artifact.needed_until) > index:
+                remaining.append(artifact)
+            else:
+                result = self._release(artifact)
+
+                if result is not None:
+                    released.append((artifact.path,) + result)
+
+        self.artifacts = remaining
+        self.finished.append(stage)
+
+        with self._lock:
+            if index + 1 < len(STAGES):
+                self.current_stage = STAGES[index + 1]
+
+        return released
+
+    def _release(self, artifact: Artifact) -> Optional[Tuple[str, Optional[str]]]:
+        """Release an artifact, returns the action taken and a warning (if any)."""
+        path = artifact.path
+
+        if artifact.on_release == KEEP or not os.path.lexists(path):
+            return None
+
+        action = artifact.on_release
+        warning = None
+        archive_size = 0
+        size = disk_usage(path)
+
+        if action == COMPRESS:
+            archive = path + '.tar.gz'
+
+            try:
+                with tarfile.open(archive, 'w:gz') as tar:
+                    tar.add(path, arcname=os.path.basename(path))
+
+                archive_size = disk_usage(archive)
+            except (OSError, tarfile.TarError) as err:
+                # most likely out of space, a partial archive is of no use
+                if os.path.lexists(archive):
+                    os.remove(archive)
+
+                action = DELETE
+                warning = 'compression failed ({}), deleted instead'.format(err)
+
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+        # only count what is actually gone, rmtree may have left files behind
+        removed = size - disk_usage(path)
+
+        if removed <= 0 and os.path.lexists(path):
+            return None
+
+        if path in self.hot_files and not os.path.lexists(path):
+            self.hot_files.remove(path)
+
+        self.released[path] = removed - archive_size
+
+        return action, warning
+
+    def close(self) -> None:
+        """Stop the monitor and remove the tmpfs directory."""
+        self.stop_monitor()
+        self.sample()
+
+        if self.hot_dir is not None:
+            shutil.rmtree(self.hot_dir, ignore_errors=True)
+            self.hot_dir = None
+            self.hot_files = []
+
+    def summary(self) -> str:
+        return 'Peak disk footprint: {} (during {}), freed early: {}'.format(
+            format_size(self.peak_bytes),
+            self.peak_stage,
+            format_size(sum(self.released.values())),
+        )
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the tool is deployed as a folder of plain modules, not as a package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '0_0_1'))
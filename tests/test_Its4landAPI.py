@@ -0,0 +1,232 @@
+"""Integrity checks of the transfers against a local HTTP server."""
+
+from http.server import (BaseHTTPRequestHandler, ThreadingHTTPServer)
+import base64
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+
+import pytest
+
+from Its4landAPI import (Its4landAPI, Its4landException)
+
+
+BODY = os.urandom(3 * 1024 * 1024)
+CUT_OFF = 1000 * 1000
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *argv):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+
+        if self.path.endswith('/missing'):
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if self.server.gzip:
+            # the checksum headers describe the encoded body
+            body = gzip.compress(BODY)
+
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-MD5', base64.b64encode(hashlib.md5(body).digest()).decode())
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        content_range = re.match(r'bytes=(\d+)-', self.headers.get('Range', ''))
+        start = int(content_range.group(1)) if content_range else 0
+        body = BODY[start:]
+
+        self.send_response(206 if content_range else 200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-MD5', self.server.md5)
+
+        if content_range:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, len(BODY) - 1, len(BODY)))
+
+        self.end_headers()
+
+        if self.server.truncate and not content_range:
+            # drop the connection in the middle of the body
+            self.wfile.write(body[:CUT_OFF])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.server.requests.append(dict(self.headers))
+        self.rfile.read(int(self.headers['Content-Length']))
+
+        # the fields of the platform's ContentItemEndpointType
+        body = json.dumps({
+            'ContentID': 'item-{}'.format(len(self.server.requests)),
+            'ContentType': 'image/tiff',
+            'ContentName': 'odm_orthophoto.tif',
+            'ContentSize': self.server.content_size,
+            'ContentDescription': '',
+        }).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class Server(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # clients closing the connection early is what some tests are about
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.delenv('I4L_PROCESSUID', raising=False)
+
+    httpd = Server(('127.0.0.1', 0), Handler)
+    httpd.requests = []
+    httpd.truncate = False
+    httpd.gzip = False
+    httpd.content_size = len(BODY)
+    httpd.md5 = base64.b64encode(hashlib.md5(BODY).digest()).decode()
+
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    yield httpd
+
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def make_api(server) -> Its4landAPI:
+    api = Its4landAPI(url='http://127.0.0.1:{}'.format(server.server_port), api_key='1')
+    api.session_token = '1'
+
+    return api
+
+
+def test_download_file(server, tmp_path):
+    api = make_api(server)
+    filename = str(tmp_path / 'images.zip')
+
+    api.download_file(None, url=api.url + 'file', filename=filename)
+
+    with open(filename, 'rb') as f:
+        assert f.read() == BODY
+
+    assert api.transfer_stats['retries'] == 0
+    assert api.transfer_stats['bytes'] == len(BODY)
+
+
+def test_download_file_resumes_truncated_transfer(server, tmp_path):
+    server.truncate = True
+    api = make_api(server)
+    filename = str(tmp_path / 'images.zip')
+
+    api.download_file(None, url=api.url + 'file', filename=filename)
+
+    with open(filename, 'rb') as f:
+        assert f.read() == BODY
+
+    assert len(server.requests) == 2
+    assert 'Range' not in server.requests[0]
+    # only whole chunks are kept from the broken transfer
+    resumed_from = int(re.match(r'bytes=(\d+)-', server.requests[1]['Range']).group(1))
+    assert 0 < resumed_from <= CUT_OFF
+    assert api.transfer_stats['ranged_retries'] == 1
+
+
+def test_download_file_checksum_mismatch(server, tmp_path):
+    server.md5 = base64.b64encode(hashlib.md5(b'something else').digest()).decode()
+    api = make_api(server)
+
+    with pytest.raises(Its4landException) as err:
+        api.download_file(None, url=api.url + 'file', filename=str(tmp_path / 'images.zip'), retries=1)
+
+    assert 'Checksum mismatch' in err.value.content
+    # the bad range is unknown, so the whole file is fetched again
+    assert len(server.requests) == 2
+    assert 'Range' not in server.requests[1]
+
+
+def test_download_file_http_error_is_not_retried(server, tmp_path):
+    api = make_api(server)
+
+    with pytest.raises(Its4landException) as err:
+        api.download_file(None, url=api.url + 'missing', filename=str(tmp_path / 'images.zip'))
+
+    assert err.value.code == 404
+    assert len(server.requests) == 1
+
+
+def test_download_file_stop(server, tmp_path):
+    api = make_api(server)
+    stop = threading.Event()
+    stop.set()
+
+    with pytest.raises(Its4landException) as err:
+        api.download_file(None, url=api.url + 'file', filename=str(tmp_path / 'images.zip'), stop=stop)
+
+    assert 'cancelled' in err.value.msg
+    assert len(server.requests) == 1
+
+
+def test_download_file_encoded_body(server, tmp_path):
+    server.gzip = True
+    api = make_api(server)
+    filename = str(tmp_path / 'images.zip')
+
+    api.download_file(None, url=api.url + 'file', filename=filename)
+
+    with open(filename, 'rb') as f:
+        assert f.read() == BODY
+
+    assert len(server.requests) == 1
+
+
+def test_upload_content_item(server, tmp_path):
+    filename = tmp_path / 'odm_orthophoto.tif'
+    filename.write_bytes(BODY)
+    api = make_api(server)
+
+    item = api.upload_content_item(str(filename))
+
+    assert item['ContentID'] == 'item-1'
+    assert api.transfer_stats['retries'] == 0
+    assert api.transfer_stats['bytes'] == len(BODY)
+
+
+def test_upload_content_item_size_mismatch(server, tmp_path, capsys):
+    server.content_size = len(BODY) - 1
+    filename = tmp_path / 'odm_orthophoto.tif'
+    filename.write_bytes(BODY)
+    api = make_api(server)
+
+    with pytest.raises(Its4landException) as err:
+        api.upload_content_item(str(filename), retries=1)
+
+    assert err.value.content == 'Platform stored {} bytes of {}'.format(len(BODY) - 1, len(BODY))
+    assert len(server.requests) == 2
+    assert api.transfer_stats['retries'] == 1
+
+    out = capsys.readouterr().out
+    # the API cannot delete content items, both rejected ones are reported
+    assert 'content item item-1 is unusable' in out
+    assert 'content item item-2 is unusable' in out
+    assert 'Retrying upload' in out
@@ -0,0 +1,152 @@
+"""Parsing and validation of GCP lists against synthetic images."""
+
+import os
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pyproj = pytest.importorskip('pyproj')
+PIL = pytest.importorskip('PIL')
+
+from PIL import Image
+from PIL.TiffImagePlugin import IFDRational
+
+from gcp import (GCPError, check_gcp_list, parse_gcp_list)
+
+
+LON, LAT = 9.0, 48.0
+HEADER = 'WGS84 UTM 32N'
+
+
+def to_dms(value: float):
+    degrees = int(value)
+    minutes = int((value - degrees) * 60)
+    seconds = ((value - degrees) * 60 - minutes) * 60
+
+    return (IFDRational(degrees), IFDRational(minutes), IFDRational(int(seconds * 1000), 1000))
+
+
+@pytest.fixture
+def image_dir(tmp_path):
+    """Five 400x300 images with their camera 0.001 degrees apart."""
+    dirname = tmp_path / 'images'
+    dirname.mkdir()
+
+    for i in range(5):
+        img = Image.new('RGB', (400, 300))
+        exif = img.getexif()
+        exif[0x8825] = {1: 'N', 2: to_dms(LAT), 3: 'E', 4: to_dms(LON + i * 0.001)}
+        img.save(str(dirname / 'IMG_{}.JPG'.format(i)), exif=exif)
+
+    return str(dirname)
+
+
+def gcp_rows(swap: bool = False):
+    transformer = pyproj.Transformer.from_crs('EPSG:4326', 'EPSG:32632', always_xy=True)
+    rows = []
+
+    for gcp in range(4):
+        x, y = transformer.transform(LON + gcp * 0.001 + 0.0002, LAT + 0.0002)
+
+        if swap:
+            x, y = y, x
+
+        for i in range(5):
+            rows.append('{:.3f} {:.3f} 100 10 10 IMG_{}.JPG gcp{}'.format(x, y, i, gcp))
+
+    return rows
+
+
+def write_gcp_list(tmp_path, rows, header=HEADER) -> str:
+    filename = tmp_path / 'gcp_list.txt'
+    filename.write_text('\n'.join([header] + rows) + '\n')
+
+    return str(filename)
+
+
+def test_parse_gcp_list(tmp_path):
+    filename = write_gcp_list(tmp_path, gcp_rows()[:2] + ['not a gcp row'])
+
+    gcps, skipped = parse_gcp_list(filename)
+
+    assert gcps.header == HEADER
+    assert len(gcps) == 2
+    assert gcps.geo.shape == (2, 3)
+    assert gcps.pixels.tolist() == [[10, 10], [10, 10]]
+    assert list(gcps.images) == ['IMG_0.JPG', 'IMG_1.JPG']
+    assert list(gcps.names) == ['gcp0', 'gcp0']
+    assert len(skipped) == 1
+
+
+def test_valid_gcp_list(tmp_path, image_dir):
+    filename = write_gcp_list(tmp_path, gcp_rows())
+
+    report = check_gcp_list(filename, image_dir)
+
+    assert report[-1] == '20 of 20 GCP rows usable, 4 distinct GCPs'
+
+
+def test_missing_image(tmp_path, image_dir):
+    filename = write_gcp_list(tmp_path, gcp_rows() + ['1 2 3 10 10 IMG_9.JPG gcp0'])
+
+    report = check_gcp_list(filename, image_dir)
+
+    assert any('"IMG_9.JPG" is not in the zip' in line for line in report)
+    assert 'IMG_9.JPG' not in open(filename).read()
+
+
+
+def test_unreadable_image(tmp_path, image_dir):
+    with open(os.path.join(image_dir, 'IMG_4.JPG'), 'wb') as f:
+        f.write(b'not a jpeg')
+
+    filename = write_gcp_list(tmp_path, gcp_rows())
+
+    report = check_gcp_list(filename, image_dir)
+
+    assert sum('"IMG_4.JPG" cannot be read' in line for line in report) == 4
+    assert 'IMG_4.JPG' not in open(filename).read()
+    assert report[-1] == '16 of 20 GCP rows usable, 4 distinct GCPs'
+
+
+def test_image_name_case_is_fixed(tmp_path, image_dir):
+    rows = [row.replace('IMG_0.JPG', 'img_0.jpg') for row in gcp_rows()]
+    filename = write_gcp_list(tmp_path, rows)
+
+    report = check_gcp_list(filename, image_dir)
+
+    assert any('"img_0.jpg" is named "IMG_0.JPG"' in line for line in report)
+    assert 'img_0.jpg' not in open(filename).read()
+    assert report[-1] == '20 of 20 GCP rows usable, 4 distinct GCPs'
+
+
+def test_pixel_outside_of_image(tmp_path, image_dir):
+    rows = gcp_rows()
+    rows[0] = rows[0].replace(' 10 10 ', ' 1000 10 ')
+    filename = write_gcp_list(tmp_path, rows)
+
+    report = check_gcp_list(filename, image_dir)
+
+    assert any('outside of the 400x300 image' in line for line in report)
+    assert report[-1] == '19 of 20 GCP rows usable, 4 distinct GCPs'
+
+
+def test_swapped_axes(tmp_path, image_dir):
+    filename = write_gcp_list(tmp_path, gcp_rows(swap=True))
+
+    with pytest.raises(GCPError, match='axes look swapped'):
+        check_gcp_list(filename, image_dir)
+
+
+def test_bad_crs_header(tmp_path, image_dir):
+    filename = write_gcp_list(tmp_path, gcp_rows(), header='NOT A CRS')
+
+    with pytest.raises(GCPError, match='Unrecognized CRS header "NOT A CRS"'):
+        check_gcp_list(filename, image_dir)
+
+
+def test_too_few_gcps(tmp_path, image_dir):
+    filename = write_gcp_list(tmp_path, gcp_rows()[:10])
+
+    with pytest.raises(GCPError, match='At least 3 usable GCPs are needed, found 2'):
+        check_gcp_list(filename, image_dir)
@@ -0,0 +1,62 @@
+"""Job isolation of the local scheduler."""
+
+import json
+
+import pytest
+
+import scheduler
+
+
+def write_jobs(tmp_path, jobs) -> str:
+    filename = tmp_path / 'jobs.json'
+    filename.write_text(json.dumps(jobs))
+
+    return str(filename)
+
+
+def test_load_jobs_rejects_non_string_arguments(tmp_path):
+    filename = write_jobs(tmp_path, [['--dsm'], {'args': ['--dem-resolution', 5]}])
+
+    with pytest.raises(AssertionError, match='Job #1'):
+        scheduler.load_jobs(filename)
+
+
+@pytest.mark.parametrize('name', ['..', '.', '', '../other', 'a/b', '/tmp/job'])
+def test_load_jobs_rejects_paths_as_names(tmp_path, name):
+    filename = write_jobs(tmp_path, [{'name': name, 'args': []}])
+
+    with pytest.raises(AssertionError, match='not a valid job name'):
+        scheduler.load_jobs(filename)
+
+
+@pytest.mark.parametrize('env', [['I4L_PROCESSUID'], {'I4L_PROCESSUID': 1}, {'I4L_PROCESSUID': None}])
+def test_load_jobs_rejects_non_string_env(tmp_path, env):
+    filename = write_jobs(tmp_path, [{'args': [], 'env': env}])
+
+    with pytest.raises(AssertionError, match='env has to map strings to strings'):
+        scheduler.load_jobs(filename)
+
+
+def test_jobs_do_not_inherit_the_platform_process(tmp_path, monkeypatch):
+    monkeypatch.setenv('I4L_PROCESSUID', 'scheduler-process')
+    monkeypatch.setenv('I4L_PROJECTUID', 'scheduler-project')
+    # print the environment and the arguments instead of running orthophoto.py
+    monkeypatch.setattr(scheduler, 'ORTHOPHOTO_SCRIPT', '-c')
+
+    script = 'import os, sys; print(os.environ.get("I4L_PROCESSUID"), os.environ.get("I4L_PROJECTUID"), sys.argv[1:])'
+    jobs = scheduler.load_jobs(write_jobs(tmp_path, [
+        {'name': 'a', 'args': [script]},
+        {'name': 'b', 'args': [script], 'env': {'I4L_PROCESSUID': 'job-b'}, 'max_concurrency': 3},
+    ]))
+
+    results = scheduler.schedule(jobs, str(tmp_path / 'jobs'))
+
+    assert [r['returncode'] for r in results] == [0, 0]
+
+    log_a = (tmp_path / 'jobs' / 'a' / 'job.log').read_text()
+    log_b = (tmp_path / 'jobs' / 'b' / 'job.log').read_text()
+
+    assert log_a.startswith('None None')
+    assert log_b.startswith('job-b None')
+    assert "'--project-path', '{}'".format(tmp_path / 'jobs' / 'b') in log_b
+    assert "'--max-concurrency', '3'" in log_b
@@ -0,0 +1,164 @@
+"""Artifact lifetimes and footprint accounting of the work volume."""
+
+import os
+import tarfile
+
+import pytest
+
+import workspace
+from workspace import (Workspace, COMPRESS, DELETE, KEEP)
+
+
+def write(path, size: int) -> str:
+    os.makedirs(os.path.dirname(str(path)), exist_ok=True)
+
+    with open(str(path), 'wb') as f:
+        f.write(os.urandom(size))
+
+    return str(path)
+
+
+@pytest.fixture
+def ws(tmp_path):
+    ws = Workspace(str(tmp_path / 'work'))
+    os.makedirs(ws.root)
+
+    yield ws
+
+    ws.close()
+
+
+def test_artifacts_are_released_after_their_last_stage(ws):
+    zip_filename = ws.register(write(ws.path('images.zip'), 1024), needed_until='download')
+    images = ws.register(write(ws.path('images', 'a.jpg'), 1024), needed_until='odm')
+    orthophoto = ws.register(write(ws.path('odm_orthophoto.tif'), 1024), needed_until='upload')
+
+    assert ws.finish_stage('download') == [(zip_filename, DELETE, None)]
+    assert ws.finish_stage('extract') == []
+    assert os.path.exists(images)
+
+    assert ws.finish_stage('odm') == [(images, DELETE, None)]
+    assert not os.path.exists(images)
+    assert os.path.exists(orthophoto)
+
+    assert ws.finish_stage('upload') == [(orthophoto, DELETE, None)]
+    assert ws.finished == ['download', 'extract', 'odm', 'upload']
+
+
+def test_later_stage_releases_everything_before_it(ws):
+    zip_filename = ws.register(write(ws.path('images.zip'), 1024), needed_until='download')
+
+    assert ws.finish_stage('odm') == [(zip_filename, DELETE, None)]
+    assert ws.current_stage == 'upload'
+
+
+def test_release_policies(ws):
+    deleted = ws.register(write(ws.path('opensfm', 'a.bin'), 4096), 'odm', DELETE)
+    compressed = ws.register(os.path.dirname(write(ws.path('odm_meshing', 'mesh.ply'), 4096)), 'odm', COMPRESS)
+    kept = ws.register(write(ws.path('odm_texturing', 'model.obj'), 4096), 'odm', KEEP)
+
+    released = ws.finish_stage('odm')
+
+    assert [(path, action) for path, action, _ in released] == [(deleted, DELETE), (compressed, COMPRESS)]
+    assert not os.path.exists(deleted)
+    assert not os.path.exists(compressed)
+    assert os.path.exists(kept)
+
+    with tarfile.open(compressed + '.tar.gz') as tar:
+        assert tar.getnames() == ['odm_meshing', 'odm_meshing/mesh.ply']
+
+
+def test_failed_compression_falls_back_to_delete(ws, monkeypatch):
+    dirname = ws.register(os.path.dirname(write(ws.path('odm_meshing', 'mesh.ply'), 4096)), 'odm', COMPRESS)
+
+    class FullDisk:
+        def __init__(self, name, mode):
+            open(name, 'wb').close()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def add(self, *args, **kwargs):
+            raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr(workspace.tarfile, 'open', FullDisk)
+
+    [(path, action, warning)] = ws.finish_stage('odm')
+
+    assert (path, action) == (dirname, DELETE)
+    assert 'No space left on device' in warning
+    assert not os.path.exists(dirname)
+    assert not os.path.exists(dirname + '.tar.gz')
+
+
+def test_only_removed_bytes_are_counted(ws, monkeypatch):
+    dirname = ws.register(os.path.dirname(write(ws.path('opensfm', 'a.bin'), 4096)), 'odm')
+
+    # e.g. files owned by another user
+    monkeypatch.setattr(workspace.shutil, 'rmtree', lambda *args, **kwargs: None)
+
+    assert ws.finish_stage('odm') == []
+    assert ws.released == {}
+    assert os.path.exists(dirname)
+
+
+def test_summary_reports_peak_and_freed_bytes(ws):
+    ws.register(write(ws.path('images.zip'), 64 * 1024), needed_until='download')
+    ws.register(write(ws.path('images', 'a.jpg'), 64 * 1024), needed_until='odm')
+
+    ws.finish_stage('download')
+    peak = ws.peak_bytes
+    ws.finish_stage('extract')
+    ws.finish_stage('odm')
+
+    assert peak >= 128 * 1024
+    assert ws.peak_bytes == peak
+    assert ws.peak_stage == 'download'
+    assert sum(ws.released.values()) >= 128 * 1024
+    assert ws.summary() == 'Peak disk footprint: {} (during download), freed early: {}'.format(
+        workspace.format_size(peak), workspace.format_size(sum(ws.released.values())))
+
+
+def test_hot_path_uses_tmpfs_if_there_is_room(ws, tmp_path, monkeypatch):
+    os.makedirs(str(tmp_path / 'shm'))
+    monkeypatch.setattr(workspace, 'TMPFS_DIR', str(tmp_path / 'shm'))
+    monkeypatch.setattr(workspace, 'TMPFS_MIN_FREE', 0)
+    monkeypatch.setattr(workspace, 'available_memory', lambda: workspace.TMPFS_RESERVE + 1024 ** 2)
+
+    path = ws.hot_path('metadata.json', size_hint=1024)
+
+    assert os.path.dirname(path) == ws.hot_dir
+    assert ws.hot_dir.startswith(str(tmp_path / 'shm'))
+    assert ws.hot_files == [path]
+
+    ws.close()
+
+    assert ws.hot_dir is None
+    assert os.listdir(str(tmp_path / 'shm')) == []
+
+
+def test_hot_path_falls_back_to_the_work_volume(ws, tmp_path, monkeypatch):
+    os.makedirs(str(tmp_path / 'shm'))
+    monkeypatch.setattr(workspace, 'TMPFS_DIR', str(tmp_path / 'shm'))
+    monkeypatch.setattr(workspace, 'TMPFS_MIN_FREE', 0)
+    monkeypatch.setattr(workspace, 'available_memory', lambda: workspace.TMPFS_RESERVE)
+
+    assert ws.hot_path('metadata.json', size_hint=1024) == ws.path('metadata.json')
+
+    # enough memory but a tmpfs smaller than the file
+    monkeypatch.setattr(workspace, 'available_memory', lambda: 64 * 1024 ** 3)
+    monkeypatch.setattr(workspace, 'TMPFS_MIN_FREE', 2 ** 62)
+
+    assert ws.hot_path('gcp_list.txt', size_hint=1024) == ws.path('gcp_list.txt')
+    assert ws.hot_dir is None
+    assert ws.hot_files == []
+
+
+def test_hot_path_without_tmpfs(ws, tmp_path, monkeypatch):
+    monkeypatch.setattr(workspace, 'TMPFS_DIR', str(tmp_path / 'missing'))
+    monkeypatch.setattr(workspace, 'available_memory', lambda: 64 * 1024 ** 3)
+
+    assert ws.hot_path('metadata.json') == ws.path('metadata.json')